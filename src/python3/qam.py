@@ -17,6 +17,11 @@ class Qam:
         self.bits_per_baud = bits_per_baud
         self.carrier_freq  = carrier_freq
 
+        # constellation point of each symbol, a*(cos(p) + j*sin(p)), computed
+        # once so that no trigonometry is needed per symbol
+        self.symbols = {t: np.complex64(a*np.exp(1j*p/180.0*np.pi))
+                for t,(a,p) in modulation.items()}
+
     def generate_signal(self, data):
         '''
         Generate signal corresponding to the current modulation scheme to
@@ -26,15 +31,19 @@ class Qam:
         def create_func(data):
             slot_data = []
             for i in range(0,len(data),self.bits_per_baud):
-                slot_data.append(self.modulation[data[i:i+self.bits_per_baud]])
+                slot_data.append(self.symbols[data[i:i+self.bits_per_baud]])
+            slot_data = np.array(slot_data, dtype=np.complex64)
 
+            # vectorized over an array of sample times, t, so that the whole
+            # signal is synthesized at once; a*sin(wt + p) is expanded into
+            # the in-phase and quadrature parts of the constellation point
             def timefunc(t):
-                slot = int(t*self.baud_rate)
-                start = float(slot)/self.baud_rate
+                slot = (t*self.baud_rate).astype(int)
+                start = slot/self.baud_rate
                 offset = t - start
-                amplitude,phase = slot_data[slot]
-                return amplitude*np.sin(2*np.pi*self.carrier_freq*offset +
-                        phase/180.0*np.pi)
+                carrier = 2*np.pi*self.carrier_freq*offset
+                point = slot_data[slot]
+                return point.real*np.sin(carrier) + point.imag*np.cos(carrier)
 
             return timefunc
 
@@ -47,8 +56,7 @@ class Qam:
         '''
         Plot a constellation diagram representing the modulation scheme.
         '''
-        data = [(a*np.cos(p/180.0*np.pi), a*np.sin(p/180.0*np.pi), t) 
-                for t,(a,p) in self.modulation.items()]
+        data = [(z.real, z.imag, t) for t,z in self.symbols.items()]
         sx,sy,t = zip(*data)
         plt.clf()
         plt.scatter(sx,sy,s=30)
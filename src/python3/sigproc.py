@@ -15,67 +15,148 @@
 # chaiporn.j@ku.ac.th
 ############################################################################
 
+import functools
+import math
+import os
 import numpy as np
+import scipy.fft
 from matplotlib import pyplot as plt
-from scipy.fftpack import fft, ifft
+from scipy.fft import rfft, irfft, next_fast_len
 from scipy.io import wavfile
 
+def use_pyfftw(planner_effort='FFTW_ESTIMATE', keepalive=60.0):
+    '''
+    Use FFTW through pyFFTW as the scipy.fft backend for all subsequent
+    transforms, with one thread per CPU.  FFTW plans are kept for keepalive
+    seconds after their last use, so only repeated transforms of the same
+    length benefit from a more expensive planner_effort such as
+    'FFTW_MEASURE'.  Raises ImportError if pyFFTW is not installed.
+    '''
+    import pyfftw
+    import pyfftw.interfaces.scipy_fft
+    pyfftw.interfaces.cache.enable()
+    pyfftw.interfaces.cache.set_keepalive_time(keepalive)
+    pyfftw.config.NUM_THREADS = os.cpu_count() or 1
+    pyfftw.config.PLANNER_EFFORT = planner_effort
+    scipy.fft.set_global_backend(pyfftw.interfaces.scipy_fft)
+
 plt.rc('font', family='Sawasdee', weight='bold') # if not available, will fallback to other font
 plt.rc('axes', unicode_minus=False)
 
+_DEG = math.pi/180.0 # degrees to radians
+
+@functools.lru_cache(maxsize=8)
+def _axis(stop, num):
+    '''
+    Return a read-only array of num evenly spaced values from 0 to stop,
+    shared by every signal asking for the same axis
+    '''
+    axis = np.linspace(0, stop, num)
+    axis.setflags(write=False)
+    return axis
+
 class Signal(object):
-    def __init__(self, duration=1.0, sampling_rate=22050, func=None):
+    def __init__(self, duration=1.0, sampling_rate=22050, func=None,
+            dtype=np.complex64, fast_len=False):
         '''
         Initialize a signal object with the specified duration (in seconds)
         and sampling rate (in Hz).  If func is provided, signal
         data will be initialized to values of this function for the entire
         duration.
+
+        The spectrum is stored with the given complex dtype.  The default,
+        complex64, halves memory use and speeds up the transforms at the cost
+        of about 7 significant digits, which is plenty for plots and 16-bit
+        wav output; use complex128 when double precision is needed.
+
+        If fast_len is True, the number of samples is rounded up to the next
+        length the FFT handles efficiently and the duration is extended to
+        match.  Frequencies stay exact, but the signal becomes slightly longer
+        than requested.
+
+        Since the time-domain signal is real-valued, only the non-negative
+        half of its spectrum (num_samples//2 + 1 frequencies) is stored; the
+        negative frequencies are implicitly the complex conjugates.
+
+        The time-domain signal is cached until one of the methods modifies
+        the spectrum.  After writing to freqs directly, call invalidate() so
+        the next get_time_domain() reflects the change.
         '''
+        n = int(duration*sampling_rate)
+        if fast_len and n > 0:
+            n = next_fast_len(n, real=True)
+            duration = float(n)/sampling_rate
+
         self.duration = duration
         self.sampling_rate = sampling_rate
-        self.freqs = np.arange(int(duration*sampling_rate), dtype=complex)
-        self.freqs[:] = 0j
+        self.num_samples = n
+        self.dtype = np.dtype(dtype)
+        self.freqs = np.zeros(n//2+1, dtype=self.dtype)
+
+        # time-domain signal is cached until the spectrum changes
+        self._dirty = True
+        self._time_cache = None
+
         if func is not None:
             self.sample_time_function(func)
 
+    def invalidate(self):
+        '''
+        Discard the cached time-domain signal; needed only after modifying
+        freqs directly instead of through the methods of this class
+        '''
+        self._dirty = True
+
     def set_freq(self, freq, amplitude, phase=0):
         '''
         Set a particular frequency component with the specified amplitude and
         phase-shift (in degree) to the signal
         '''
-        n = len(self.freqs)
+        self._dirty = True
+        n = self.num_samples
 
         # compute the index at which the specified frequency is located in the
         # array
-        index = int(np.round(float(freq)*n/self.sampling_rate))
+        index = int(round(freq*n/self.sampling_rate))
 
         # distribute the signal amplitude over the real and imaginary axes
-        re = float(n)*amplitude*np.cos(phase*np.pi/180.0)
-        im = float(n)*amplitude*np.sin(phase*np.pi/180.0)
+        phi = phase*_DEG
+        scale = n*amplitude
+        z = complex(scale*math.cos(phi), scale*math.sin(phi))
 
         # distribute AC component evenly over positive and negative
-        # frequencies
+        # frequencies; only the positive part is stored, the negative one
+        # being its complex conjugate
         if freq != 0: 
-            re = re/2.0
-            im = im/2.0
+            z = z/2.0
 
-            # to ensure real-valued time-domain signal, the two parts need to
-            # be complex conjugate of each other
-            self.freqs[ index] = re + 1j*im
-            self.freqs[-index] = re - 1j*im
+            # negative frequencies and those above the Nyquist frequency
+            # alias onto a bin of the full spectrum; past the Nyquist bin,
+            # that is the mirror of a stored bin, so fold back and conjugate
+            index %= n
+            if index > n//2:
+                index = n - index
+                z = z.conjugate()
 
-        else:
-            # DC component has only one part
-            self.freqs[index] = re + 1j*im
+        self.freqs[index] = z
 
     def get_time_domain(self):
         '''
         Return a tuple (X,Y) where X is an array storing the time axis,
-        and Y is an array storing time-domain representation of the signal
+        and Y is an array storing time-domain representation of the signal.
+        Both arrays are cached and read-only.
         '''
-        x_axis = np.linspace(0, self.duration, len(self.freqs))
-        y_axis = ifft(self.freqs).real
-        return x_axis, y_axis
+        if not self._dirty:
+            return self._time_cache
+
+        n = self.num_samples
+        x_axis = _axis(self.duration, n)
+        y_axis = irfft(self.freqs, n=n, workers=-1)
+
+        y_axis.setflags(write=False)
+        self._time_cache = (x_axis, y_axis)
+        self._dirty = False
+        return self._time_cache
 
     def get_freq_domain(self):
         '''
@@ -84,34 +165,74 @@ class Signal(object):
         P are arrays storing the amplitude and phase shift (in degree) of each
         frequency
         '''
-        n = len(self.freqs)
-        num_freqs = int(np.ceil((n+1)/2.0))
-        x_axis = np.linspace(0, self.sampling_rate/2.0, num_freqs)
+        x_axis, a_axis = self.get_amplitudes()
+        _, p_axis = self.get_phases()
+        return x_axis, a_axis, p_axis
 
-        # extract only positive frequencies and scale them so that the
-        # magnitude does not depend on the length of the array
-        a_axis = abs(self.freqs[:num_freqs])/float(n)
-        p_axis = np.arctan2(
-                    self.freqs[:num_freqs].imag,
-                    self.freqs[:num_freqs].real) * 180.0/np.pi
+    def get_amplitudes(self):
+        '''
+        Return a tuple (X,A) where X is an array storing the frequency axis
+        up to the Nyquist frequency and A is an array storing the amplitude of
+        each frequency
+        '''
+        n = self.num_samples
+        x_axis, re, im = self._positive_freqs()
+
+        # scale the magnitude so that it does not depend on the length of the
+        # array
+        a_axis = np.hypot(re, im)
+        a_axis /= n
 
         # double amplitudes of the AC components (since we have thrown away
         # the negative frequencies)
-        a_axis[1:] = a_axis[1:]*2
+        a_axis[1:] *= 2
 
-        return x_axis, a_axis, p_axis
+        return x_axis, a_axis
+
+    def get_phases(self):
+        '''
+        Return a tuple (X,P) where X is an array storing the frequency axis
+        up to the Nyquist frequency and P is an array storing the phase shift
+        (in degree) of each frequency
+        '''
+        x_axis, re, im = self._positive_freqs()
+        return x_axis, np.degrees(np.arctan2(im, re))
+
+    def _positive_freqs(self):
+        '''
+        Return a tuple (X,RE,IM) holding the frequency axis and the real and
+        imaginary parts of the spectrum up to the Nyquist frequency (real and
+        imaginary parts are strided views, no copy is made)
+        '''
+        x_axis = _axis(self.sampling_rate/2.0, len(self.freqs))
+        return x_axis, self.freqs.real, self.freqs.imag
 
-    def clear(self, cond=lambda f:True):
+    def clear(self, cond=None):
         '''
         Set amplitudes of all frequencies satisfying the condition, cond, to
         zero, where cond is a boolean function that takes a frequency in Hz.
+        If cond is not provided, all frequencies are cleared.
         '''
-        n = len(self.freqs)
-        for i in range(n):
-            # convert index to corresponding frequency value
-            f = float(i)*self.sampling_rate/n
-            if cond(f):
-                self.freqs[i] = 0j
+        self._dirty = True
+        if cond is None:
+            self.freqs[:] = 0
+            return
+
+        n = self.num_samples
+
+        # convert every index to its corresponding frequency value at once
+        f = np.arange(len(self.freqs), dtype=np.float64)*(self.sampling_rate/n)
+
+        # try cond on the whole array first; fall back to calling it once per
+        # frequency when it is not array-aware
+        try:
+            mask = np.asarray(cond(f), dtype=bool)
+        except (TypeError, ValueError):
+            mask = None
+        if mask is None or mask.shape != f.shape:
+            mask = np.fromiter((cond(x) for x in f), dtype=bool, count=len(f))
+
+        self.freqs[mask] = 0
 
     def copy(self):
         '''
@@ -120,6 +241,8 @@ class Signal(object):
         s = Signal()
         s.duration = self.duration
         s.sampling_rate = self.sampling_rate
+        s.num_samples = self.num_samples
+        s.dtype = self.dtype
         s.freqs = np.array(self.freqs)
         return s
     
@@ -128,8 +251,9 @@ class Signal(object):
         Mix the signal with another given signal.  Sampling rate and duration
         of both signals must match.
         '''
+        self._dirty = True
         if self.sampling_rate != signal.sampling_rate \
-           or len(self.freqs) != len(signal.freqs):
+           or self.num_samples != signal.num_samples:
             raise Exception(
                 'Signal to mix must have identical sampling rate and duration')
 
@@ -139,23 +263,45 @@ class Signal(object):
         '''
         Generate a band-limited square wave on to the signal object
         '''
-        self.clear()
-        f = freq
-        while f <= flimit:
-            self.set_freq(f, 1.0/f, -90)
-            f += 2*freq
+        self._dirty = True
+        self.freqs[:] = 0
+        n = self.num_samples
+
+        # odd harmonics of freq up to flimit, each with amplitude 1/f and a
+        # phase shift of -90 degrees
+        harmonics = freq*np.arange(1, flimit/freq + 1, 2, dtype=np.float64)
+        harmonics = harmonics[harmonics <= flimit]
+        index = np.round(harmonics*n/self.sampling_rate).astype(np.intp)
+        z = -0.5j*n/harmonics
+
+        # same layout as set_freq, for all harmonics at once
+        index %= n
+        folded = index > n//2
+        index[folded] = n - index[folded]
+        z[folded] = z[folded].conjugate()
+        self.freqs[index] = z
 
     def sample_time_function(self, func):
         '''
         Sample values from a time-domain, real-valued function, func(t), where
         t will be specified in second.  Samples are collected at the
-        sampling rate associated with the Signal object.
+        sampling rate associated with the Signal object.  If func accepts a
+        NumPy array of times, all samples are computed in a single call.
         '''
-        n = len(self.freqs)
-        signal = np.arange(n, dtype=float)
-        for i in range(n):
-            signal[i] = func(float(i)/self.sampling_rate)
-        self.freqs = fft(signal)
+        self._dirty = True
+        n = self.num_samples
+        t = np.arange(n, dtype=np.float64)/self.sampling_rate
+
+        # try func on all sample times at once first; fall back to calling it
+        # once per sample when it is not array-aware
+        try:
+            signal = np.asarray(func(t), dtype=float)
+        except (TypeError, ValueError):
+            signal = None
+        if signal is None or signal.shape != t.shape:
+            signal = np.fromiter((func(x) for x in t), dtype=float, count=n)
+
+        self.freqs = rfft(signal, workers=-1).astype(self.dtype, copy=False)
     
     def shift_freq(self, offset):
         '''
@@ -164,7 +310,8 @@ class Signal(object):
         along the frequency axis.  If offset is negative, the signal is
         shifted to the left along the frequency axis.
         '''
-        n = len(self.freqs)
+        self._dirty = True
+        n = self.num_samples
         nyquist = int(n//2)
 
         # compute the array-based index from the specified offset in Hz
@@ -173,19 +320,20 @@ class Signal(object):
             raise Exception(
             'Shifting offset cannot be greater than the Nyquist frequency')
 
+        # negative frequencies are implied by the stored half, so they shift
+        # along with it
         if offset > 0:
             self.freqs[offset:nyquist] = np.copy(self.freqs[:nyquist-offset])
             self.freqs[:offset] = 0
 
-            self.freqs[-nyquist+1:-offset] = np.copy(self.freqs[-(nyquist-offset)+1:])
-            self.freqs[-offset+1:] = 0
+            # the DC component has no negative-frequency twin, so its share
+            # is halved once it becomes an AC component
+            if offset < nyquist:
+                self.freqs[offset] /= 2
         else:
             offset = -offset
             self.freqs[:nyquist-offset] = np.copy(self.freqs[offset:nyquist])
             self.freqs[nyquist-offset:nyquist] = 0
-
-            self.freqs[-(nyquist-offset)+1:] = np.copy(self.freqs[-nyquist+1:-offset])
-            self.freqs[-nyquist+1:-nyquist+offset] = 0
     
     def __add__(self, s):
         newSignal = self.copy()
@@ -199,17 +347,19 @@ class Signal(object):
         wavfile.write(
                 wav_file, 
                 self.sampling_rate, 
-                (ifft(self.freqs).real*32768).astype(np.dtype('int16')))
+                (self.get_time_domain()[1]*32768).astype(np.dtype('int16')))
 
     def read_wav(self, wav_file, channel='left'):
         '''
         Read data from the specified wave file into the signal object.  For a
         stereo stream, only one channel ('left' or 'right') can be extracted.
         '''
+        self._dirty = True
         rate,data = wavfile.read(wav_file)
         n = data.shape[0]
         self.sampling_rate = rate
         self.duration = float(n)/rate
+        self.num_samples = n
 
         if data.dtype == np.dtype('int16'):
             normalizer = 32768.0
@@ -226,7 +376,7 @@ class Signal(object):
             else:
                 raise(Exception('Invalid channel choice "%s"' % channel))
 
-        self.freqs = fft(data/normalizer)
+        self.freqs = rfft(data/normalizer, workers=-1).astype(self.dtype, copy=False)
 
     def plot(self, dB=False, phase=False, stem=False, frange=(0,10000)):
         '''
@@ -254,15 +404,32 @@ class Signal(object):
         plt.grid(True)
         plt.xlabel(u'Time (s)')
         plt.ylabel('Value')
-        plt.plot(x,y,'g')
+        if len(y) > 4096:
+            # long signals are drawn as a min/max envelope over 2048 bins,
+            # which looks the same on screen but renders far fewer vertices
+            # each bin is drawn as a step spanning its own samples, the last
+            # one ending at the final sample like plt.plot would
+            edges = np.linspace(0, len(y), 2049).astype(int)[:-1]
+            lo = np.minimum.reduceat(y, edges)
+            hi = np.maximum.reduceat(y, edges)
+            plt.fill_between(np.append(x[edges], x[-1]),
+                    np.append(lo, lo[-1]), np.append(hi, hi[-1]),
+                    step='post', color='g')
+        else:
+            plt.plot(x,y,'g')
 
         # plot frequency vs. amplitude
-        x,a,p = self.get_freq_domain()
-        start_index = int(float(frange[0])/self.sampling_rate*len(self.freqs))
-        stop_index  = int(float(frange[1])/self.sampling_rate*len(self.freqs))
+        # phases are only computed when they are going to be plotted
+        if phase:
+            x,a,p = self.get_freq_domain()
+        else:
+            x,a = self.get_amplitudes()
+        start_index = int(float(frange[0])/self.sampling_rate*self.num_samples)
+        stop_index  = int(float(frange[1])/self.sampling_rate*self.num_samples)
         x = x[start_index:stop_index]
         a = a[start_index:stop_index]
-        p = p[start_index:stop_index]
+        if phase:
+            p = p[start_index:stop_index]
         plt.subplot(num_plots, 1, 2)
         plt.cla()
         plt.grid(True)